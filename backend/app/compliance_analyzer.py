@@ -2,18 +2,47 @@
 AI-Powered Compliance Analysis Service
 Uses Google Gemini to analyze Form C against compliance checklist
 """
-import google.generativeai as genai
-from typing import Dict, List
+from cachetools import LRUCache
+import orjson
+import zstandard
+from pydantic import ValidationError
+from typing import AsyncGenerator, Dict, List
+import asyncio
+import functools
+import hashlib
 import os
 import logging
 
 try:
     from .compliance_issues_checklist import get_all_issues_as_prompt
+    from .schemas import ComplianceReport
+    from .token_budget import count_tokens, fit_to_budget
 except ImportError:
     from compliance_issues_checklist import get_all_issues_as_prompt
+    from schemas import ComplianceReport
+    from token_budget import count_tokens, fit_to_budget
 
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "gemini-2.0-flash-exp"  # Use Gemini 2.0 Flash for fast results
+
+# Output cap per call. A full JSON report (verifications, compliant
+# disclosures, personnel and reasoned amendments) regularly needs several
+# thousand tokens; lower this only once the candidates_token_count logged by
+# _log_usage shows reports consistently fit.
+MAX_OUTPUT_TOKENS = 8000
+
+# Number of analysis results kept in memory for repeated uploads
+RESULT_CACHE_SIZE = 128
+
+# zstd level for cached results (legal prose compresses well at moderate levels)
+RESULT_CACHE_ZSTD_LEVEL = 6
+
+# Context budget per Gemini call; Form Cs larger than this are sharded
+FORM_C_TOKEN_BUDGET = 800_000
+SHARD_OVERLAP_TOKENS = 500
+MAX_CONCURRENT_CHUNKS = 5
+
 
 # Compliance Checklist based on Rule 201 requirements
 COMPLIANCE_CHECKLIST = """
@@ -167,9 +196,62 @@ Issuer: {issuer_name}
 {form_c_text}
 
 Generate the complete compliance report now. Be thorough and check for ALL the specific issues listed above.
+Return the report as JSON matching the response schema, with one entry per finding in each section.
+"""
+
+# The instructions, specific issues and checklist are identical for every
+# request, so they are formatted once here and prepended to the
+# issuer-specific suffix of each call.
+_PREFIX_TEMPLATE, _FORM_C_HEADER, _SUFFIX_TEMPLATE = REVIEW_PROMPT_TEMPLATE.partition("**FORM C TO ANALYZE:**")
+STATIC_PREFIX = _PREFIX_TEMPLATE.format(
+    specific_issues=get_all_issues_as_prompt(),
+    checklist=COMPLIANCE_CHECKLIST
+)
+DYNAMIC_SUFFIX = _FORM_C_HEADER + _SUFFIX_TEMPLATE
+
+# Per-request prompts are built by concatenating these static pieces with the
+# issuer name and Form C text, avoiding a str.format pass over the template
+_SUFFIX_HEAD, _, _SUFFIX_REST = DYNAMIC_SUFFIX.partition("{issuer_name}")
+_SUFFIX_MIDDLE, _, _SUFFIX_TAIL = _SUFFIX_REST.partition("{form_c_text}")
+
+def _hit_token_limit(response) -> bool:
+    """True if generation stopped because it reached max_output_tokens"""
+    return any(
+        getattr(candidate.finish_reason, "name", None) == "MAX_TOKENS"
+        for candidate in response.candidates
+    )
+
+
+def _log_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        logger.info("Report used %s of %s output tokens", usage.candidates_token_count, MAX_OUTPUT_TOKENS)
+    if _hit_token_limit(response):
+        logger.warning("Report was cut off at %s output tokens", MAX_OUTPUT_TOKENS)
+
+
+# Mixed into result cache keys so checklist/prompt changes invalidate old results
+_PROMPT_VERSION = hashlib.sha256((STATIC_PREFIX + DYNAMIC_SUFFIX).encode()).hexdigest()
+
+FIX_JSON_PROMPT = """
+The following JSON compliance report does not match the required schema.
+
+Validation errors:
+{errors}
+
+JSON:
+{report_json}
+
+Return the corrected JSON only, keeping all findings.
 """
 
 
+@functools.lru_cache(maxsize=None)
+def _prompt_overhead_tokens() -> int:
+    """Tokens used by everything in a prompt except the Form C (computed on first use, not at import)"""
+    return count_tokens(STATIC_PREFIX + DYNAMIC_SUFFIX) + 100  # + issuer name and chunk label
+
+
 class ComplianceAnalyzer:
     """Analyze Form C documents for compliance using AI"""
     
@@ -179,13 +261,145 @@ class ComplianceAnalyzer:
         if not self.api_key:
             raise ValueError("Gemini API key is required")
         
-        # Configure Gemini
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')  # Use Gemini 2.0 Flash for fast results
+        # Imported here rather than at module level: the SDK pulls in grpc and
+        # protobuf, which workers that never analyze a Form C don't need to load
+        import google.generativeai as genai
+        self._genai = genai
+        
+        # Configure Gemini over gRPC. The SDK keeps its clients (and their
+        # HTTP/2 channels) in a process-wide client manager, so every request
+        # reuses the same connection instead of a new TLS handshake.
+        genai.configure(api_key=self.api_key, transport="grpc")
+        self.model = genai.GenerativeModel(MODEL_NAME)
+        
+        # Analysis results keyed by _result_key, so re-analyzing the same Form C skips Gemini.
+        # Stored compressed: smaller per worker and ready to move to a shared store.
+        self._result_cache = LRUCache(maxsize=RESULT_CACHE_SIZE)
+    
+    def _result_key(self, issuer_name: str, form_c_text: str) -> str:
+        """Cache key for an analysis: SHA-256 of prompt version, issuer and Form C text"""
+        digest = hashlib.sha256(_PROMPT_VERSION.encode())
+        digest.update(issuer_name.encode())
+        digest.update(b"\0")
+        digest.update(form_c_text.encode())
+        return digest.hexdigest()
+    
+    def _cached_result(self, key: str):
+        """Return a fresh copy of a cached result, or None"""
+        payload = self._result_cache.get(key)
+        if payload is None:
+            return None
+        logger.info("Returning cached analysis result")
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(payload))
+    
+    def _store_result(self, key: str, result: Dict) -> Dict:
+        """Cache a successful result (as zstd-compressed JSON bytes) and return it"""
+        if result["success"]:
+            compressor = zstandard.ZstdCompressor(level=RESULT_CACHE_ZSTD_LEVEL)
+            self._result_cache[key] = compressor.compress(orjson.dumps(result))
+        return result
+    
+    async def warmup(self):
+        """Issue a 1-token request to open the connection to Gemini ahead of real traffic"""
+        await self.model.generate_content_async(
+            "ping",
+            generation_config=self._genai.types.GenerationConfig(max_output_tokens=1)
+        )
+    
+    async def _generate(self, prompt: str) -> str:
+        """Generate a report for one prompt, logging its output token usage"""
+        response = await self.model.generate_content_async(
+            STATIC_PREFIX + prompt, generation_config=self._generation_config()
+        )
+        _log_usage(response)
+        return response.text
+    
+    async def _stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        """Stream the report for one prompt as text pieces"""
+        response = await self.model.generate_content_async(
+            STATIC_PREFIX + prompt, generation_config=self._generation_config(), stream=True
+        )
+        async for chunk in response:
+            yield chunk.text
+    
+    async def _validate_report(self, report_json: str) -> ComplianceReport:
+        """Validate a JSON report, asking Gemini once to fix it if it does not match the schema"""
+        try:
+            return ComplianceReport.model_validate_json(report_json)
+        except ValidationError as e:
+            logger.warning("Report JSON failed validation, retrying: %s", e)
+            response = await self.model.generate_content_async(
+                FIX_JSON_PROMPT.format(errors=str(e), report_json=report_json),
+                generation_config=self._generation_config()
+            )
+            return ComplianceReport.model_validate_json(response.text)
     
-    def analyze_form_c(self, issuer_name: str, form_c_text: str) -> Dict:
+    def _build_prompts(self, issuer_name: str, form_c_text: str) -> List[str]:
+        """Build the issuer-specific part of the review prompt for each Form C chunk"""
+        chunks = fit_to_budget(
+            form_c_text,
+            budget_tokens=FORM_C_TOKEN_BUDGET,
+            prompt_overhead=_prompt_overhead_tokens(),
+            overlap_tokens=SHARD_OVERLAP_TOKENS
+        )
+        
+        total = len(chunks)
+        
+        prompts = []
+        for k, chunk in enumerate(chunks, start=1):
+            if total > 1:
+                chunk = (
+                    f"[CHUNK {k}/{total} - this is one part of a longer document; "
+                    f"report only what can be found in this part]\n\n{chunk}"
+                )
+            prompts.append("".join((_SUFFIX_HEAD, issuer_name, _SUFFIX_MIDDLE, chunk, _SUFFIX_TAIL)))
+        return prompts
+    
+    def _generation_config(self):
+        """Generation settings shared by every analysis call"""
+        return self._genai.types.GenerationConfig(
+            temperature=0.2,  # Even lower temperature for maximum consistency
+            max_output_tokens=MAX_OUTPUT_TOKENS,
+            top_p=0.9,  # Slightly lower for more focused responses
+            top_k=40,  # Add top_k for additional consistency
+            response_mime_type="application/json",  # Schema-conformant JSON, no text parsing
+            response_schema=ComplianceReport,
+        )
+    
+    def _build_result(self, issuer_name: str, reports: List[ComplianceReport]) -> Dict:
+        """Merge per-chunk reports into a single result"""
+        report = self._merge_reports(reports)
+        analysis_text = report.to_markdown()
+        
+        structured_analysis = report.model_dump()
+        structured_analysis["raw_text"] = analysis_text
+        
+        return {
+            "success": True,
+            "issuer_name": issuer_name,
+            "raw_analysis": analysis_text,
+            "structured_analysis": structured_analysis,
+            "model_used": MODEL_NAME,
+            "error": None
+        }
+    
+    def _error_result(self, issuer_name: str, error: Exception) -> Dict:
+        logger.error("Error analyzing Form C: %s", error)
+        return {
+            "success": False,
+            "issuer_name": issuer_name,
+            "raw_analysis": "",
+            "structured_analysis": {},
+            "error": str(error)
+        }
+    
+    async def analyze_form_c_async(self, issuer_name: str, form_c_text: str) -> Dict:
         """
-        Analyze a Form C document for compliance issues
+        Analyze a Form C document for compliance issues without blocking the event loop
+        
+        Documents larger than FORM_C_TOKEN_BUDGET are split into overlapping
+        chunks which are sent to Gemini concurrently (at most
+        MAX_CONCURRENT_CHUNKS at a time).
         
         Args:
             issuer_name: Name of the issuer
@@ -194,71 +408,107 @@ class ComplianceAnalyzer:
         Returns:
             Dictionary containing structured compliance analysis
         """
+        key = self._result_key(issuer_name, form_c_text)
+        cached = self._cached_result(key)
+        if cached is not None:
+            return cached
+        
         try:
-            # Prepare the prompt with specific issues
-            specific_issues = get_all_issues_as_prompt()
+            # Tokenizing the whole Form C (and the first BPE download) would block the event loop
+            prompts = await asyncio.to_thread(self._build_prompts, issuer_name, form_c_text)
+            logger.info("Analyzing Form C for %s (%s chunks)...", issuer_name, len(prompts))
             
-            prompt = REVIEW_PROMPT_TEMPLATE.format(
-                specific_issues=specific_issues,
-                checklist=COMPLIANCE_CHECKLIST,
-                issuer_name=issuer_name,
-                form_c_text=form_c_text[:100000]  # Limit to ~100k chars to fit in context
-            )
+            if len(prompts) == 1:
+                # Common case - the whole Form C fits in one call
+                reports = [await self._validate_report(await self._generate(prompts[0]))]
+            else:
+                # Chunks are independent prompts, so they cannot share one
+                # generate_content request: a list of contents is read as a
+                # single multi-turn conversation and candidate_count only
+                # samples alternative answers to the same prompt. fit_to_budget
+                # already packs shards to the context limit, so the number of
+                # calls is minimal; run them concurrently over the shared client.
+                sem = asyncio.Semaphore(MAX_CONCURRENT_CHUNKS)
+                
+                async def sem_call(prompt: str) -> ComplianceReport:
+                    async with sem:
+                        return await self._validate_report(await self._generate(prompt))
+                
+                reports = await asyncio.gather(*[sem_call(p) for p in prompts])
             
-            logger.info(f"Analyzing Form C for {issuer_name}...")
+            return self._store_result(key, self._build_result(issuer_name, list(reports)))
             
-            # Call Gemini API with enhanced consistency settings
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.2,  # Even lower temperature for maximum consistency
-                    max_output_tokens=8000,  # Gemini can handle longer outputs
-                    top_p=0.9,  # Slightly lower for more focused responses
-                    top_k=40,  # Add top_k for additional consistency
-                )
-            )
+        except Exception as e:
+            return self._error_result(issuer_name, e)
+    
+    async def analyze_form_c_stream(self, issuer_name: str, form_c_text: str) -> AsyncGenerator[Dict, None]:
+        """
+        Analyze a Form C document, yielding events as the report is generated
+        
+        Chunks of long documents are streamed one after another so the
+        report JSON arrives in order.
+        
+        Args:
+            issuer_name: Name of the issuer
+            form_c_text: Extracted text from Form C PDF
             
-            analysis_text = response.text
+        Yields:
+            {"event": "delta", "chunk": k, "text": ...} for every piece of
+            generated JSON and a final {"event": "done", ...} carrying the
+            same fields as analyze_form_c_async (or {"event": "error", ...})
+        """
+        key = self._result_key(issuer_name, form_c_text)
+        cached = self._cached_result(key)
+        if cached is not None:
+            yield {"event": "done", **cached}
+            return
+        
+        try:
+            prompts = await asyncio.to_thread(self._build_prompts, issuer_name, form_c_text)
+            logger.info("Streaming Form C analysis for %s (%s chunks)...", issuer_name, len(prompts))
             
-            # Parse the response into structured data
-            structured_analysis = self._parse_analysis(analysis_text)
+            reports = []
+            for k, prompt in enumerate(prompts, start=1):
+                pieces = []
+                async for text in self._stream(prompt):
+                    pieces.append(text)
+                    yield {"event": "delta", "chunk": k, "text": text}
+                reports.append(await self._validate_report("".join(pieces)))
             
-            return {
-                "success": True,
-                "issuer_name": issuer_name,
-                "raw_analysis": analysis_text,
-                "structured_analysis": structured_analysis,
-                "model_used": "gemini-2.0-flash-exp",
-                "error": None
-            }
+            yield {"event": "done", **self._store_result(key, self._build_result(issuer_name, reports))}
             
         except Exception as e:
-            logger.error(f"Error analyzing Form C: {str(e)}")
-            return {
-                "success": False,
-                "issuer_name": issuer_name,
-                "raw_analysis": "",
-                "structured_analysis": {},
-                "error": str(e)
-            }
+            yield {"event": "error", **self._error_result(issuer_name, e)}
     
-    def _parse_analysis(self, analysis_text: str) -> Dict:
+    def _merge_reports(self, reports: List[ComplianceReport]) -> ComplianceReport:
         """
-        Parse the AI analysis into structured sections
+        Combine the reports for several chunks
         
-        This is a simple parser - in production, you might want to use
-        structured output or more sophisticated parsing
+        Amendments reported by more than one chunk (overlapping text) are
+        deduplicated on their (rule, issue) pair, other entries on their
+        full contents.
         """
-        sections = {
+        if len(reports) == 1:
+            return reports[0]
+        
+        merged = {
             "amendments": [],
             "verifications": [],
             "compliant_disclosures": [],
             "key_personnel": []
         }
+        seen = {name: set() for name in merged}
         
-        # For now, return the raw text in sections
-        # In a production system, you'd parse this more carefully
-        sections["raw_text"] = analysis_text
+        for report in reports:
+            for name in merged:
+                for finding in getattr(report, name):
+                    if name == "amendments":
+                        key = (finding.rule, finding.issue)
+                    else:
+                        key = tuple(finding.model_dump().values())
+                    if key in seen[name]:
+                        continue
+                    seen[name].add(key)
+                    merged[name].append(finding)
         
-        return sections
-
+        return ComplianceReport(**merged)
@@ -2,6 +2,7 @@
 Specific compliance issues checklist for Form C review
 Based on SEC Rule 201 requirements
 """
+from collections import namedtuple
 
 COMPLIANCE_ISSUES_CHECKLIST = {
     "ownership_structure": [
@@ -278,8 +279,31 @@ COMPLIANCE_ISSUES_CHECKLIST = {
     ]
 }
 
-def get_all_issues_as_prompt():
-    """Convert the checklist into a format suitable for AI prompt"""
+ComplianceIssue = namedtuple("ComplianceIssue", "category issue rule severity check")
+
+# Flat, read-only view of the checklist built once at import. With a few
+# dozen rules that are not queried per request, plain tuples plus the
+# prebuilt indices below beat a DataFrame (no extra dependency, O(1) lookups).
+_FLAT_ISSUES = tuple(
+    ComplianceIssue(category, issue["issue"], issue["rule"], issue["severity"], issue["check"])
+    for category, issues in COMPLIANCE_ISSUES_CHECKLIST.items()
+    for issue in issues
+)
+
+_ISSUES_BY_SEVERITY = {}
+for _issue in _FLAT_ISSUES:
+    _ISSUES_BY_SEVERITY.setdefault(_issue.severity, []).append(_issue)
+_ISSUES_BY_SEVERITY = {severity: tuple(issues) for severity, issues in _ISSUES_BY_SEVERITY.items()}
+
+# Keyed by every known rule citation; like get_issues_by_rule, a key also
+# matches more specific citations (e.g. "Rule 100" includes "Rule 100(b)")
+_ISSUES_BY_RULE = {
+    rule: tuple(issue for issue in _FLAT_ISSUES if rule in issue.rule)
+    for rule in {issue.rule for issue in _FLAT_ISSUES}
+}
+
+
+def _build_issues_prompt():
     prompt_sections = []
     
     for category, issues in COMPLIANCE_ISSUES_CHECKLIST.items():
@@ -295,20 +319,30 @@ def get_all_issues_as_prompt():
     
     return "\n".join(prompt_sections)
 
+
+_ISSUES_PROMPT = _build_issues_prompt()
+
+
+def get_all_issues_as_prompt():
+    """Convert the checklist into a format suitable for AI prompt (precomputed)"""
+    return _ISSUES_PROMPT
+
 def get_issues_by_severity(severity):
-    """Get all issues of a specific severity level"""
-    issues = []
-    for category, category_issues in COMPLIANCE_ISSUES_CHECKLIST.items():
-        for issue in category_issues:
-            if issue['severity'] == severity:
-                issues.append(issue)
-    return issues
+    """
+    Get all issues of a specific severity level
+    
+    Returns a shared tuple of ComplianceIssue; use list(...) to get a mutable copy.
+    """
+    return _ISSUES_BY_SEVERITY.get(severity, ())
 
 def get_issues_by_rule(rule):
-    """Get all issues related to a specific rule"""
-    issues = []
-    for category, category_issues in COMPLIANCE_ISSUES_CHECKLIST.items():
-        for issue in category_issues:
-            if rule in issue['rule']:
-                issues.append(issue)
+    """
+    Get all issues related to a specific rule
+    
+    Returns a shared tuple of ComplianceIssue; use list(...) to get a mutable copy.
+    """
+    issues = _ISSUES_BY_RULE.get(rule)
+    if issues is None:
+        # Partial citation (e.g. "Rule 201") - fall back to a substring scan
+        issues = tuple(issue for issue in _FLAT_ISSUES if rule in issue.rule)
     return issues
@@ -0,0 +1,130 @@
+"""
+Content-hash cache for document extraction results
+Re-extracting an unchanged file returns the stored result without parsing it again
+"""
+from typing import Callable
+import functools
+import hashlib
+import inspect
+import json
+import mmap
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("FORMC_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "formc"))
+
+# Entries hold full document text, so they are not kept indefinitely: older
+# entries are ignored and deleted, and only the newest ones are kept
+CACHE_MAX_AGE = int(os.getenv("FORMC_CACHE_MAX_AGE", 7 * 24 * 3600))  # seconds
+CACHE_MAX_ENTRIES = int(os.getenv("FORMC_CACHE_MAX_ENTRIES", 256))
+
+
+def file_fingerprint(path: str) -> str:
+    """BLAKE2b digest of a file's contents, read through mmap"""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                digest.update(mm)
+    return digest.hexdigest()
+
+
+def _is_fresh(cache_path: str) -> bool:
+    """True if cache_path exists and is younger than CACHE_MAX_AGE"""
+    try:
+        return os.path.getmtime(cache_path) >= time.time() - CACHE_MAX_AGE
+    except OSError:
+        return False
+
+
+def _evict():
+    """Delete cache entries older than CACHE_MAX_AGE, then the oldest beyond CACHE_MAX_ENTRIES"""
+    try:
+        with os.scandir(CACHE_DIR) as entries:
+            cached = [(e.stat().st_mtime, e.path) for e in entries if e.name.endswith(".json")]
+    except OSError:
+        return
+    cached.sort(reverse=True)
+    cutoff = time.time() - CACHE_MAX_AGE
+    for k, (mtime, path) in enumerate(cached):
+        if k >= CACHE_MAX_ENTRIES or mtime < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def file_cache(cache_if: Callable = None, version: int = 1, dump: Callable = None, load: Callable = None):
+    """
+    Cache a file extraction function's result by file contents
+
+    The first parameter (other than self) of the decorated function must be
+    the file path; any other arguments are part of the cache key. The
+    wrapper accepts an extra force_refresh=True keyword to ignore and
+    overwrite the stored result, and use_cache=False to neither read nor
+    store one.
+
+    Args:
+        cache_if: Predicate on the result; results it rejects (e.g. failed
+            extractions) are returned but not stored
+        version: Bump when the function's output format changes so older
+            entries are no longer used
+        dump: Convert a result to a JSON-serializable value before storing it
+            (defaults to storing the result as is)
+        load: Rebuild a result from its stored value; the inverse of dump
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        path_param = next(name for name in signature.parameters if name != "self")
+
+        @functools.wraps(func)
+        def wrapper(*args, force_refresh: bool = False, use_cache: bool = True, **kwargs):
+            if not use_cache:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            path = bound.arguments[path_param]
+            options = {
+                name: value for name, value in bound.arguments.items()
+                if name not in ("self", path_param)
+            }
+            try:
+                key = file_fingerprint(path)
+                if options:
+                    key += hashlib.blake2b(repr(sorted(options.items())).encode(), digest_size=8).hexdigest()
+                key = f"{func.__qualname__}-v{version}-{key}"
+            except OSError:
+                # Unreadable file - let the function report the error
+                return func(*args, **kwargs)
+            cache_path = os.path.join(CACHE_DIR, f"{key}.json")
+
+            if not force_refresh and _is_fresh(cache_path):
+                try:
+                    with open(cache_path, "r", encoding="utf-8") as f:
+                        logger.info("Using cached extraction for %s", path)
+                        stored = json.load(f)
+                    return load(stored) if load else stored
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    logger.warning("Ignoring unreadable cache entry %s: %s", cache_path, e)
+
+            result = func(*args, **kwargs)
+
+            if cache_if is None or cache_if(result):
+                try:
+                    os.makedirs(CACHE_DIR, exist_ok=True)
+                    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump(dump(result) if dump else result, f)
+                    os.replace(tmp_path, cache_path)
+                except OSError as e:
+                    logger.warning("Failed to write extraction cache: %s", e)
+                _evict()
+
+            return result
+
+        return wrapper
+
+    return decorator
@@ -4,13 +4,15 @@ Provides endpoints for uploading and analyzing Form C documents
 """
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
 from typing import Optional
+import asyncio
 import os
 import logging
-import tempfile
-import shutil
+import orjson
+import aiofiles
+import aiofiles.tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -33,21 +35,19 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Form C Review API",
     description="AI-powered compliance review for SEC Form C documents",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
+# CORSMiddleware does not expand wildcards inside allow_origins entries, so
+# local dev servers and GitHub Codespaces URLs are matched with one regex
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:5173",  # Vite default port
-        "http://localhost:3000",  # Alternative React port
-        "http://127.0.0.1:5173",
-        "http://127.0.0.1:3000",
-        "https://*.app.github.dev",  # GitHub Codespaces
-        "https://*.github.dev",      # GitHub Codespaces alternate
-        "*",  # Allow all origins for Codespaces (temporary for testing)
-    ],
+    allow_origin_regex=(
+        r"^https?://(localhost|127\.0\.0\.1)(:\d+)?$"  # Vite / React dev servers
+        r"|^https://[a-z0-9-]+\.(app\.)?github\.dev$"  # GitHub Codespaces
+    ),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -56,12 +56,45 @@ app.add_middleware(
 # Initialize services
 pdf_extractor = PDFExtractor()
 
-# Lazy initialize compliance analyzer (needs API key)
+# Read size used when saving uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+
+# Uploaded Form Cs are confidential, so their extracted text is only kept in
+# the on-disk extraction cache when explicitly enabled
+EXTRACTION_CACHE = os.getenv("EXTRACTION_CACHE", "").lower() in ("1", "true", "yes")
+
+# Compliance analyzer (needs API key) - one instance per worker process,
+# created on first use, or at startup when WARMUP is set (see warmup()).
+# Creating it loads the Gemini SDK (grpc, protobuf), so idle workers skip it.
 _compliance_analyzer = None
+WARMUP = os.getenv("WARMUP", "").lower() in ("1", "true", "yes")
+
+
+@app.on_event("startup")
+async def warmup():
+    """Create the compliance analyzer and prime the Gemini connection before the first request (WARMUP=1)"""
+    global _compliance_analyzer
+    if not WARMUP:
+        return
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        logger.warning("GEMINI_API_KEY not set, skipping analyzer warmup")
+        return
+    try:
+        _compliance_analyzer = await asyncio.to_thread(ComplianceAnalyzer, api_key=api_key)
+    except Exception as e:
+        logger.warning("Analyzer creation failed, will retry on first request: %s", e)
+        return
+    try:
+        await _compliance_analyzer.warmup()
+        logger.info("Compliance analyzer warmed up")
+    except Exception as e:
+        # The analyzer itself is usable; the first request opens the connection instead
+        logger.warning("Gemini warmup request failed: %s", e)
 
 
-def get_compliance_analyzer():
-    """Get or create compliance analyzer instance"""
+async def get_compliance_analyzer():
+    """Get the compliance analyzer, creating it if startup warmup did not"""
     global _compliance_analyzer
     if _compliance_analyzer is None:
         api_key = os.getenv("GEMINI_API_KEY")
@@ -70,18 +103,25 @@ def get_compliance_analyzer():
                 status_code=500,
                 detail="Gemini API key not configured. Please set GEMINI_API_KEY environment variable."
             )
-        _compliance_analyzer = ComplianceAnalyzer(api_key=api_key)
+        # Created off the event loop, like in warmup()
+        _compliance_analyzer = await asyncio.to_thread(ComplianceAnalyzer, api_key=api_key)
     return _compliance_analyzer
 
 
-# Response models
+# Response models - used for API docs only (see responses= on the routes);
+# routes return ORJSONResponse directly so FastAPI skips validation and
+# jsonable_encoder
 class HealthResponse(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     status: str
     message: str
     gemini_configured: bool
 
 
 class AnalysisResponse(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     success: bool
     issuer_name: str
     total_pages: int
@@ -91,47 +131,40 @@ class AnalysisResponse(BaseModel):
     error: Optional[str] = None
 
 
-@app.get("/", response_model=HealthResponse)
+@app.get("/", responses={200: {"model": HealthResponse}})
 async def root():
     """Health check endpoint"""
     api_key_configured = bool(os.getenv("GEMINI_API_KEY"))
     
-    return {
+    return ORJSONResponse({
         "status": "ok",
         "message": "Form C Review API is running",
         "gemini_configured": api_key_configured
-    }
+    })
 
 
-@app.get("/health", response_model=HealthResponse)
+@app.get("/health", responses={200: {"model": HealthResponse}})
 async def health_check():
     """Detailed health check"""
     api_key_configured = bool(os.getenv("GEMINI_API_KEY"))
     
-    return {
+    return ORJSONResponse({
         "status": "healthy",
         "message": "All services operational",
         "gemini_configured": api_key_configured
-    }
+    })
 
 
-@app.post("/api/analyze-form-c")
-async def analyze_form_c(
-    file: UploadFile = File(...),
-    issuer_name: str = Form(...)
-):
+async def extract_uploaded_pdf(file: UploadFile) -> dict:
     """
-    Analyze a Form C PDF document for compliance
+    Save an uploaded Form C PDF to a temporary file and extract its text
     
     Args:
         file: PDF file upload
-        issuer_name: Name of the issuer
         
     Returns:
-        Comprehensive compliance analysis
+        Successful extraction result from PDFExtractor
     """
-    logger.info(f"Received Form C for analysis: {issuer_name}")
-    
     # Validate file type
     if not file.filename.endswith('.pdf'):
         raise HTTPException(
@@ -140,18 +173,22 @@ async def analyze_form_c(
         )
     
     # Create temporary file to save upload
-    temp_file = None
+    temp_file_path = None
     try:
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
+        # Stream uploaded file to temporary location without blocking the event loop
+        async with aiofiles.tempfile.NamedTemporaryFile('wb', suffix='.pdf', delete=False) as temp_file:
             temp_file_path = temp_file.name
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await temp_file.write(chunk)
         
-        logger.info(f"Saved PDF to temporary file: {temp_file_path}")
+        logger.info("Saved PDF to temporary file: %s", temp_file_path)
         
-        # Extract text from PDF
+        # Extract text from PDF (CPU-bound, run in a worker thread)
         logger.info("Extracting text from PDF...")
-        extraction_result = pdf_extractor.extract_text_from_pdf(temp_file_path)
+        extraction_result = await asyncio.to_thread(
+            pdf_extractor.extract_text_from_pdf, temp_file_path, include_pages=False,
+            use_cache=EXTRACTION_CACHE
+        )
         
         if not extraction_result["success"]:
             raise HTTPException(
@@ -159,12 +196,43 @@ async def analyze_form_c(
                 detail=f"Failed to extract PDF text: {extraction_result['error']}"
             )
         
-        logger.info(f"Successfully extracted {extraction_result['total_pages']} pages")
+        logger.info("Successfully extracted %s pages", extraction_result['total_pages'])
+        return extraction_result
+        
+    finally:
+        # Clean up temporary file
+        if temp_file_path and os.path.exists(temp_file_path):
+            try:
+                os.unlink(temp_file_path)
+                logger.info("Cleaned up temporary file: %s", temp_file_path)
+            except Exception as e:
+                logger.warning("Failed to delete temporary file: %s", e)
+
+
+@app.post("/api/analyze-form-c", responses={200: {"model": AnalysisResponse}})
+async def analyze_form_c(
+    file: UploadFile = File(...),
+    issuer_name: str = Form(...)
+):
+    """
+    Analyze a Form C PDF document for compliance
+    
+    Args:
+        file: PDF file upload
+        issuer_name: Name of the issuer
+        
+    Returns:
+        Comprehensive compliance analysis
+    """
+    logger.info("Received Form C for analysis: %s", issuer_name)
+    
+    try:
+        extraction_result = await extract_uploaded_pdf(file)
         
         # Analyze with AI
         logger.info("Starting AI compliance analysis...")
-        analyzer = get_compliance_analyzer()
-        analysis_result = analyzer.analyze_form_c(
+        analyzer = await get_compliance_analyzer()
+        analysis_result = await analyzer.analyze_form_c_async(
             issuer_name=issuer_name,
             form_c_text=extraction_result["full_text"]
         )
@@ -175,10 +243,10 @@ async def analyze_form_c(
                 detail=f"AI analysis failed: {analysis_result['error']}"
             )
         
-        logger.info(f"Analysis completed successfully for {issuer_name}")
+        logger.info("Analysis completed successfully for %s", issuer_name)
         
         # Return combined results
-        return JSONResponse(content={
+        return ORJSONResponse({
             "success": True,
             "issuer_name": issuer_name,
             "total_pages": extraction_result["total_pages"],
@@ -191,28 +259,62 @@ async def analyze_form_c(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error during analysis: {str(e)}")
+        logger.error("Unexpected error during analysis: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"An unexpected error occurred: {str(e)}"
         )
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-                logger.info(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as e:
-                logger.warning(f"Failed to delete temporary file: {e}")
 
 
-@app.post("/api/test-analysis")
+@app.post("/api/analyze-form-c/stream")
+async def analyze_form_c_stream(
+    file: UploadFile = File(...),
+    issuer_name: str = Form(...)
+):
+    """
+    Analyze a Form C PDF document, streaming the report as Server-Sent Events
+    
+    Each event is a JSON object: "delta" events carry pieces of the report
+    JSON as it is generated, and the final "done" event has the same fields
+    as /api/analyze-form-c (or an "error" event if the analysis failed).
+    
+    Args:
+        file: PDF file upload
+        issuer_name: Name of the issuer
+    """
+    logger.info("Received Form C for streaming analysis: %s", issuer_name)
+    
+    try:
+        extraction_result = await extract_uploaded_pdf(file)
+        analyzer = await get_compliance_analyzer()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Unexpected error during analysis: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+    
+    async def event_stream():
+        async for event in analyzer.analyze_form_c_stream(
+            issuer_name=issuer_name,
+            form_c_text=extraction_result["full_text"]
+        ):
+            if event["event"] in ("done", "error"):
+                event["total_pages"] = extraction_result["total_pages"]
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.post("/api/test-analysis", responses={200: {"model": AnalysisResponse}})
 async def test_analysis():
     """
     Test endpoint that returns mock data similar to the frontend's current mock
     Useful for testing the frontend integration
     """
-    return JSONResponse(content={
+    return ORJSONResponse({
         "success": True,
         "issuer_name": "Test Company Inc.",
         "total_pages": 25,
@@ -220,11 +322,13 @@ async def test_analysis():
         "structured_analysis": {
             "amendments": [
                 {
+                    "category": "Financial Consistency & Math Validation",
                     "issue": "Inconsistent max offering amount",
                     "rule": "Rule 201(a)",
                     "severity": "Critical",
                     "page": 3,
-                    "summary": "Summary states $5M max; financial section shows $4.5M"
+                    "summary": "Summary states $5M max; financial section shows $4.5M",
+                    "ai_reasoning": "Compared the offering summary with the financial section"
                 }
             ],
             "verifications": [],
@@ -239,5 +343,21 @@ async def test_analysis():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    if os.getenv("RELOAD", "").lower() in ("1", "true", "yes"):
+        # Development: single process with autoreload
+        uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    else:
+        # Each worker is a separate process with its own analyzer, so no
+        # locking is needed around _compliance_analyzer
+        workers = int(os.getenv("WORKERS", os.cpu_count() or 1))
+        # Exported so each worker's PDF process pool gets its share of the CPUs
+        os.environ["WORKERS"] = str(workers)
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=port,
+            workers=workers,
+            loop="uvloop",
+            http="httptools"
+        )
 
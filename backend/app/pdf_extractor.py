@@ -2,89 +2,370 @@
 PDF Text Extraction Service for Form C documents
 """
 import pdfplumber
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from typing import Dict, List
+import contextlib
+import io
+import mmap
+import multiprocessing
+import os
+import threading
 import logging
 
+try:
+    from .file_cache import file_cache
+except ImportError:
+    from file_cache import file_cache
+
 logger = logging.getLogger(__name__)
 
+# Page-processing strategy by document size: (max pages, strategy), first
+# match wins. Smaller PDFs are not worth a pool's startup cost; large ones are
+# split into page ranges across processes to get around the GIL. There is no
+# thread tier: pdfminer is pure Python and holds the GIL, so threads only
+# added overhead.
+PAGE_TIERS = (
+    (200, "sequential"),
+    (None, "processes"),
+)
+
+# Form C financial tables are ruled, so cells are found from drawn lines
+# only. Spelled out so tables are stable across pdfplumber versions.
+TABLE_SETTINGS = {
+    "vertical_strategy": "lines",
+    "horizontal_strategy": "lines",
+    "snap_tolerance": 3,
+}
+
+
+@dataclass(slots=True, frozen=True)
+class PageText:
+    """Text of a single PDF page"""
+    page: int
+    text: str
+    
+    def to_dict(self) -> Dict[str, any]:
+        """JSON-serializable form for API responses and the extraction cache"""
+        return {"page": self.page, "text": self.text}
+
+
+def _pages_to_dicts(result: Dict[str, any]) -> Dict[str, any]:
+    """Make an extraction result JSON-serializable for file_cache"""
+    return {**result, "pages": [page.to_dict() for page in result["pages"]]}
+
+
+def _pages_from_dicts(result: Dict[str, any]) -> Dict[str, any]:
+    """Inverse of _pages_to_dicts"""
+    result["pages"] = tuple(PageText(**page) for page in result["pages"])
+    return result
+
+
+# Process pool for the "processes" tier, shared by every PDFExtractor in this
+# process and created on first use (see _get_process_pool)
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _process_pool_size() -> int:
+    """
+    Worker processes per server process
+    
+    The CPUs are divided between the uvicorn workers (WORKERS, set by
+    main.py) so that all of their pools together run one process per CPU.
+    """
+    server_workers = max(1, int(os.getenv("WORKERS", "1")))
+    return max(1, (os.cpu_count() or 1) // server_workers)
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool, creating it on first use"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # The server process runs grpc and event loop threads, so its
+            # workers are started from a clean forkserver (spawn where forkserver
+            # is unavailable) instead of forking it
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _process_pool = ProcessPoolExecutor(
+                max_workers=_process_pool_size(),
+                mp_context=multiprocessing.get_context(method)
+            )
+        return _process_pool
+
+
+def _reset_process_pool():
+    """Drop a broken shared pool so the next large PDF starts a new one"""
+    global _process_pool
+    with _process_pool_lock:
+        _process_pool = None
+
+
+def select_strategy(total_pages: int) -> str:
+    """Pick the PAGE_TIERS strategy for a document with total_pages pages"""
+    for max_pages, strategy in PAGE_TIERS:
+        if max_pages is None or total_pages <= max_pages:
+            return strategy
+
+
+def _process_page(page, text: bool, tables: bool) -> tuple:
+    """Extract a pdfplumber page's text and/or tables, then release its parsed objects"""
+    page_text = page.extract_text() if text else None
+    page_tables = page.extract_tables(table_settings=TABLE_SETTINGS) if tables else None
+    page.flush_cache()
+    return page_text, page_tables
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int, backend: str,
+                        text: bool, tables: bool) -> List[tuple]:
+    """Pool worker: open the PDF and extract pages [start, stop) as (page_text, page_tables) pairs"""
+    if backend == "pymupdf":
+        with fitz.open(pdf_path) as doc:
+            return [(doc[i].get_text("text"), None) for i in range(start, stop)]
+    
+    with PDFExtractor._open(pdf_path) as stream, pdfplumber.open(stream) as pdf:
+        return [_process_page(page, text, tables) for page in pdf.pages[start:stop]]
+
 
 class PDFExtractor:
     """Extract text and data from Form C PDF documents"""
     
-    def extract_text_from_pdf(self, pdf_path: str) -> Dict[str, any]:
+    def __init__(self, max_workers: int = None):
+        """
+        Args:
+            max_workers: Processes used to process page ranges in parallel (defaults to the number of CPUs)
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+    
+    @staticmethod
+    @contextlib.contextmanager
+    def _open(pdf_path: str):
+        """
+        Memory-map a PDF read-only for pdfplumber
+        
+        Parsing then reads straight from the OS page cache the content-hash
+        cache has just filled, instead of through a second buffered file.
+        """
+        with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+    
+    def _map_page_ranges(self, executor, pdf_path: str, total_pages: int, batch: int,
+                         backend: str, text: bool, tables: bool):
+        """
+        Extract contiguous ranges of at most batch pages on executor, preserving page order
+        
+        Every range opens the PDF itself: pdfminer reads objects through the
+        document's single parser stream, so one open PDF must never be used
+        from several threads or processes at once.
+        """
+        futures = [
+            executor.submit(_extract_page_range, pdf_path, start, min(start + batch, total_pages),
+                            backend, text, tables)
+            for start in range(0, total_pages, batch)
+        ]
+        for future in futures:
+            yield from future.result()
+    
+    @contextlib.contextmanager
+    def iter_pages(self, pdf_path: str, backend: str = "pymupdf"):
+        """
+        Lazily extract a PDF's text one page at a time
+        
+        The PDF stays open for the duration of the with block, and only the
+        current page is held in memory:
+        
+            with extractor.iter_pages(path) as pages:
+                for page_num, text in pages:
+                    ...
+        
+        Args:
+            pdf_path: Path to the PDF file
+            backend: "pymupdf" (falls back to pdfplumber if PyMuPDF is not
+                installed) or "pdfplumber"
+            
+        Returns:
+            Context manager yielding a generator of (page_num, text) pairs
+            for every page, including empty ones
+        """
+        if backend == "pymupdf" and fitz is not None:
+            with fitz.open(pdf_path) as doc:
+                yield ((page_num, page.get_text("text")) for page_num, page in enumerate(doc, start=1))
+        else:
+            with self._open(pdf_path) as stream, pdfplumber.open(stream) as pdf:
+                def pages():
+                    for page_num, page in enumerate(pdf.pages, start=1):
+                        page_text = page.extract_text()
+                        # Drop the page's parsed chars so memory stays flat
+                        page.flush_cache()
+                        yield page_num, page_text
+                yield pages()
+    
+    def _extract(self, pdf_path: str, text: bool, tables: bool, include_pages: bool = True,
+                 backend: str = "pdfplumber") -> Dict[str, any]:
+        """
+        Extract text and/or tables from a PDF in a single pass over its pages
+        
+        backend="pymupdf" extracts text only. Pages are processed sequentially
+        or on processes depending on the page count (see PAGE_TIERS).
+        Raises on failure; the public methods turn errors into their result shapes.
+        """
+        # PyMuPDF reads the page count from the page tree without parsing any
+        # page, so large PDFs go straight to the pool without a pdfplumber open
+        total_pages = None
+        if fitz is not None:
+            with fitz.open(pdf_path) as doc:
+                total_pages = doc.page_count
+        strategy = select_strategy(total_pages) if total_pages is not None else None
+        
+        if strategy == "sequential" and backend == "pymupdf":
+            # PyMuPDF documents are not thread-safe, so pages are streamed in order
+            with self.iter_pages(pdf_path, backend="pymupdf") as pages:
+                return self._collect(((page_text, None) for _, page_text in pages), include_pages)
+        if strategy != "processes":
+            # Small PDF, or no PyMuPDF to count pages with
+            with self._open(pdf_path) as stream, pdfplumber.open(stream) as pdf:
+                pages = pdf.pages
+                total_pages = len(pages)
+                if select_strategy(total_pages) == "sequential":
+                    return self._collect([_process_page(page, text, tables) for page in pages], include_pages)
+        
+        logger.info("Extracting %s pages of %s on a process pool", total_pages, pdf_path)
+        batch = -(-total_pages // min(self.max_workers, total_pages, _process_pool_size()))
+        try:
+            results = self._map_page_ranges(_get_process_pool(), pdf_path, total_pages, batch, backend, text, tables)
+            return self._collect(results, include_pages)
+        except BrokenProcessPool:
+            _reset_process_pool()
+            raise
+    
+    def _collect(self, results, include_pages: bool) -> Dict[str, any]:
+        """Build the extraction result from (page_text, page_tables) pairs in page order"""
+        # Written page by page so the document is never held twice (list + join)
+        buf = io.StringIO()
+        page_texts = []
+        table_list = []
+        total_pages = 0
+        
+        for page_num, (page_text, page_tables) in enumerate(results, start=1):
+            total_pages = page_num
+            if page_text:
+                if include_pages:
+                    page_texts.append(PageText(page_num, page_text))
+                if buf.tell():
+                    buf.write("\n\n")
+                buf.write("--- Page ")
+                buf.write(str(page_num))
+                buf.write(" ---\n")
+                buf.write(page_text)
+            if page_tables:
+                for table_idx, table in enumerate(page_tables):
+                    table_list.append({
+                        "page": page_num,
+                        "table_index": table_idx,
+                        "data": table
+                    })
+        
+        return {
+            "success": True,
+            "total_pages": total_pages,
+            "full_text": buf.getvalue(),
+            "pages": tuple(page_texts),
+            "tables": table_list,
+            "error": None
+        }
+    
+    @file_cache(cache_if=lambda result: result["success"], version=2,
+                dump=_pages_to_dicts, load=_pages_from_dicts)
+    def extract_all(self, pdf_path: str) -> Dict[str, any]:
+        """
+        Extract text and tables from a PDF file, opening and parsing it only once
+        
+        Results are cached by file contents; pass force_refresh=True to re-parse.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            
+        Returns:
+            Dictionary with the fields of extract_text_from_pdf plus "tables"
+            in the format returned by extract_tables_from_pdf
+        """
+        try:
+            return self._extract(pdf_path, text=True, tables=True)
+        except Exception as e:
+            logger.error("Error extracting PDF: %s", e)
+            return {
+                "success": False,
+                "total_pages": 0,
+                "full_text": "",
+                "pages": (),
+                "tables": [],
+                "error": str(e)
+            }
+    
+    @file_cache(cache_if=lambda result: result["success"], dump=_pages_to_dicts, load=_pages_from_dicts)
+    def extract_text_from_pdf(self, pdf_path: str, include_pages: bool = True,
+                              backend: str = "pymupdf") -> Dict[str, any]:
         """
         Extract all text from a PDF file
         
+        Results are cached by file contents; pass force_refresh=True to re-parse.
+        
         Args:
             pdf_path: Path to the PDF file
+            include_pages: Also return the per-page texts in "pages" as a tuple
+                of PageText; pass False when only full_text is needed to avoid
+                a second copy
+            backend: "pymupdf" (fast, falls back to pdfplumber if PyMuPDF is
+                not installed) or "pdfplumber" (layout-aware, slower)
             
         Returns:
             Dictionary containing extracted text and metadata
         """
         try:
-            full_text = []
-            page_texts = []
-            
-            with pdfplumber.open(pdf_path) as pdf:
-                total_pages = len(pdf.pages)
-                
-                for page_num, page in enumerate(pdf.pages, start=1):
-                    page_text = page.extract_text()
-                    if page_text:
-                        page_texts.append({
-                            "page": page_num,
-                            "text": page_text
-                        })
-                        full_text.append(f"--- Page {page_num} ---\n{page_text}")
-                
-                # Combine all text
-                combined_text = "\n\n".join(full_text)
-                
-                return {
-                    "success": True,
-                    "total_pages": total_pages,
-                    "full_text": combined_text,
-                    "pages": page_texts,
-                    "error": None
-                }
+            if backend == "pymupdf" and fitz is None:
+                backend = "pdfplumber"
+            result = self._extract(pdf_path, text=True, tables=False, include_pages=include_pages, backend=backend)
+            del result["tables"]
+            return result
                 
         except Exception as e:
-            logger.error(f"Error extracting PDF: {str(e)}")
+            logger.error("Error extracting PDF: %s", e)
             return {
                 "success": False,
                 "total_pages": 0,
                 "full_text": "",
-                "pages": [],
+                "pages": (),
                 "error": str(e)
             }
     
-    def extract_tables_from_pdf(self, pdf_path: str) -> List[Dict]:
+    @file_cache(version=2)
+    def _extract_tables(self, pdf_path: str) -> List[Dict]:
+        """Cached body of extract_tables_from_pdf; raises on failure so errors are never cached"""
+        return self._extract(pdf_path, text=False, tables=True)["tables"]
+    
+    def extract_tables_from_pdf(self, pdf_path: str, force_refresh: bool = False,
+                                use_cache: bool = True) -> List[Dict]:
         """
         Extract tables from PDF (useful for financial data)
         
+        Results are cached by file contents; pass force_refresh=True to re-parse.
+        
         Args:
             pdf_path: Path to the PDF file
+            force_refresh: Ignore and overwrite the cached tables
+            use_cache: Set False to neither read nor write the cache
             
         Returns:
             List of tables found in the document
         """
         try:
-            tables = []
-            
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, start=1):
-                    page_tables = page.extract_tables()
-                    if page_tables:
-                        for table_idx, table in enumerate(page_tables):
-                            tables.append({
-                                "page": page_num,
-                                "table_index": table_idx,
-                                "data": table
-                            })
-            
-            return tables
+            return self._extract_tables(pdf_path, force_refresh=force_refresh, use_cache=use_cache)
             
         except Exception as e:
-            logger.error(f"Error extracting tables: {str(e)}")
+            logger.error("Error extracting tables: %s", e)
             return []
-
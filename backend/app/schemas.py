@@ -0,0 +1,93 @@
+"""
+Structured compliance report schema
+Gemini is asked to return JSON matching ComplianceReport
+"""
+from pydantic import BaseModel
+from typing import List, Literal
+
+
+def _one_line(text: str) -> str:
+    """Collapse whitespace so a value stays on its field's line (the frontend parses line by line)"""
+    return " ".join(text.split())
+
+
+class Amendment(BaseModel):
+    """Material disclosure deficiency the issuer must correct"""
+    category: str
+    issue: str
+    rule: str
+    severity: Literal["Critical", "High", "Medium"]
+    page: int  # 0 if unknown
+    summary: str
+    ai_reasoning: str
+
+
+class Verification(BaseModel):
+    """Internal reviewer oversight check"""
+    item: str
+    status: Literal["Verified", "Pending", "Needs Review"]
+    note: str
+
+
+class CompliantDisclosure(BaseModel):
+    """Rule 201 disclosure that is present and meets minimum standards"""
+    requirement: str
+    rule: str
+
+
+class Personnel(BaseModel):
+    """Officer, director or significant owner"""
+    name: str
+    position: str
+    ownership_percentage: str  # empty if not an owner
+    is_officer: bool
+    is_director: bool
+
+
+class ComplianceReport(BaseModel):
+    """Complete Form C compliance report"""
+    amendments: List[Amendment]
+    verifications: List[Verification]
+    compliant_disclosures: List[CompliantDisclosure]
+    key_personnel: List[Personnel]
+
+    def to_markdown(self) -> str:
+        """
+        Render the report in the markdown layout the frontend parses
+        
+        zen-garden/src/utils/parseAIReport*.ts rebuild every amendment from
+        this text: a "- **Category**" header line per category, with each
+        field on its own "  - Label: value" line underneath.
+        """
+        by_category = {}
+        for a in self.amendments:
+            by_category.setdefault(a.category, []).append(a)
+
+        lines = ["**I. 🛑 Required Issuer Amendments (External Actions)**", ""]
+        for category, amendments in by_category.items():
+            lines.append(f"- **{_one_line(category)}**")
+            for a in amendments:
+                lines += [
+                    f"  - Issue description: {_one_line(a.issue)}",
+                    f"  - Rule citation: {_one_line(a.rule)}",
+                    f"  - Severity: {a.severity}",
+                    f"  - Page number: {a.page or 'N/A'}",
+                    f"  - Specific explanation: {_one_line(a.summary)}",
+                    f"  - AI reasoning: {_one_line(a.ai_reasoning)}",
+                ]
+            lines.append("")
+
+        lines += ["**II. ✅ Internal Reviewer Verification (Oversight Tasks)**", ""]
+        for k, v in enumerate(self.verifications, start=1):
+            lines.append(f"{k}. {v.item} - {v.status}: {v.note}")
+
+        lines += ["", "**III. 👍 Required Disclosures Present and Compliant (Rule 201)**", ""]
+        for d in self.compliant_disclosures:
+            lines.append(f"- {d.requirement} ({d.rule})")
+
+        lines += ["", "**IV. 🧑‍💼 Key Personnel and Significant Ownership**", ""]
+        for p in self.key_personnel:
+            ownership = f", {p.ownership_percentage}" if p.ownership_percentage else ""
+            lines.append(f"- {p.name} - {p.position}{ownership}")
+
+        return "\n".join(lines)
@@ -0,0 +1,128 @@
+"""
+Token budgeting for long Form C documents
+Splits text into shards that fit the model's context window
+"""
+from typing import List
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rough chars-per-token ratio used when tiktoken is unavailable
+_CHARS_PER_TOKEN = 4
+
+# tiktoken encoding, loaded by _get_encoding on first use (False if not installed)
+_ENCODING = None
+
+# Seconds to wait before retrying an encoding load that failed for another
+# reason (e.g. the BPE download timed out), and when the last attempt failed
+_ENCODING_RETRY_SECONDS = 60
+_encoding_failed_at = None
+
+# Split points tried in order: paragraphs, lines, then sentence ends.
+# Zero-width lookbehinds keep the separator attached so no text is lost,
+# and the period split skips decimals such as "$4.5M".
+_SEPARATORS = [
+    re.compile(r"(?<=\n\n)"),
+    re.compile(r"(?<=\n)"),
+    re.compile(r"(?<=\.)(?!\d)"),
+]
+
+
+def _get_encoding():
+    """
+    Load the tiktoken encoding on first use
+
+    tiktoken downloads the BPE file the first time an encoding is requested,
+    which fails on hosts without network access, so this runs lazily and any
+    failure falls back to estimating by characters. Only a missing tiktoken
+    is permanent; other failures are retried after _ENCODING_RETRY_SECONDS.
+    """
+    global _ENCODING, _encoding_failed_at
+    if _ENCODING is None:
+        if _encoding_failed_at is not None and time.monotonic() - _encoding_failed_at < _ENCODING_RETRY_SECONDS:
+            return None
+        try:
+            import tiktoken
+        except ImportError:
+            logger.warning("tiktoken not installed, estimating tokens from length")
+            _ENCODING = False
+            return _ENCODING
+        try:
+            # Not Gemini's tokenizer, but close enough for length estimation
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+            _encoding_failed_at = None
+        except Exception as e:
+            logger.warning("tiktoken encoding failed to load, estimating tokens from length: %s", e)
+            _encoding_failed_at = time.monotonic()
+            return None
+    return _ENCODING
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of tokens in text"""
+    encoding = _get_encoding()
+    if not encoding:
+        return -(-len(text) // _CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _split_recursive(text: str, max_tokens: int, separators: List) -> List[tuple]:
+    """Split text into (piece, tokens) pairs no larger than max_tokens, preferring coarse separators"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [(text, tokens)]
+    if not separators:
+        # No separator left - cut proportionally by characters
+        step = max(1, len(text) * max_tokens // tokens)
+        return [(text[i:i + step], count_tokens(text[i:i + step])) for i in range(0, len(text), step)]
+
+    pieces = []
+    for part in separators[0].split(text):
+        if part:
+            pieces.extend(_split_recursive(part, max_tokens, separators[1:]))
+    return pieces
+
+
+def fit_to_budget(text: str, budget_tokens: int, prompt_overhead: int = 0, overlap_tokens: int = 0) -> List[str]:
+    """
+    Fit a document into as few context-sized shards as possible
+
+    Args:
+        text: Full document text
+        budget_tokens: Context budget for a single model call
+        prompt_overhead: Tokens used by the rest of the prompt
+        overlap_tokens: Approximate tokens repeated from the end of the previous shard
+
+    Returns:
+        List of shards in document order; a single-element list when the
+        whole document fits
+    """
+    max_tokens = budget_tokens - prompt_overhead
+    if max_tokens <= 0:
+        raise ValueError("Prompt overhead exceeds the token budget")
+
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    shards = []
+    current, current_tokens = [], 0
+    for piece, tokens in _split_recursive(text, max_tokens - overlap_tokens, _SEPARATORS):
+        if current and current_tokens + tokens > max_tokens:
+            shards.append("".join(p for p, _ in current))
+            # Carry trailing pieces into the next shard as overlap
+            carried, carried_tokens = [], 0
+            for prev in reversed(current):
+                if carried_tokens + prev[1] > overlap_tokens:
+                    break
+                carried.insert(0, prev)
+                carried_tokens += prev[1]
+            current, current_tokens = carried, carried_tokens
+        current.append((piece, tokens))
+        current_tokens += tokens
+    if current:
+        shards.append("".join(p for p, _ in current))
+
+    logger.info("Split document into %s shards of at most %s tokens", len(shards), max_tokens)
+    return shards
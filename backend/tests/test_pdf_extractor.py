@@ -0,0 +1,32 @@
+"""
+Tests for PDFExtractor's page-count strategy tiers
+"""
+import pytest
+
+from app.pdf_extractor import PAGE_TIERS, select_strategy, _process_pool_size
+
+
+@pytest.mark.parametrize("total_pages, expected", [
+    (0, "sequential"),
+    (1, "sequential"),
+    (10, "sequential"),
+    (200, "sequential"),
+    (201, "processes"),
+    (5000, "processes"),
+])
+def test_select_strategy_tier_boundaries(total_pages, expected):
+    assert select_strategy(total_pages) == expected
+
+
+def test_last_tier_is_unbounded():
+    assert PAGE_TIERS[-1][0] is None
+
+
+def test_process_pool_shares_cpus_between_server_workers(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    monkeypatch.setenv("WORKERS", "4")
+    assert _process_pool_size() == 2
+
+    # More server workers than CPUs still leaves each one a process
+    monkeypatch.setenv("WORKERS", "16")
+    assert _process_pool_size() == 1
@@ -0,0 +1,130 @@
+"""
+Tests that ComplianceReport.to_markdown stays readable by the frontend parser
+"""
+import re
+
+from app.schemas import Amendment, ComplianceReport
+
+# parseAIReport.ts: one match per category header
+CATEGORY_PATTERN = re.compile(r"^-\s*\*\*([^*]+)\*\*$", re.MULTILINE)
+
+
+def parse_amendments(raw_text):
+    """Port of the amendment loop in zen-garden/src/utils/parseAIReport2.ts"""
+    amendments = []
+    current = None
+    in_amendments = False
+
+    def push(issue):
+        if issue and issue.get("issue") and issue.get("summary"):
+            amendments.append({
+                "issue": issue["issue"],
+                "rule": issue.get("rule") or "Rule 201",
+                "severity": issue.get("severity") or "Medium",
+                "summary": issue["summary"],
+                "page": issue.get("page") or 1,
+                "ai_reasoning": issue.get("ai_reasoning"),
+            })
+
+    lines = raw_text.split("\n")
+    for i, line in enumerate(lines):
+        trimmed = line.strip()
+        if "Required Issuer Amendments" in line or "🛑" in line:
+            in_amendments = True
+            continue
+        if "Internal Reviewer Verification" in line or "✅" in line:
+            in_amendments = False
+            continue
+        if "Required Disclosures Present" in line or "👍" in line:
+            in_amendments = False
+            continue
+        if not in_amendments:
+            continue
+
+        if "Issue description:" in trimmed:
+            push(current)
+            current = {}
+            text = trimmed.split("Issue description:")[1].replace("*", "").strip()
+            if text:
+                current["issue"] = text
+        elif current is not None and "Rule citation:" in trimmed:
+            current["rule"] = trimmed.split("Rule citation:")[1].replace("*", "").strip() or "Rule 201"
+        elif current is not None and "Severity:" in trimmed:
+            severity = trimmed.split("Severity:")[1].replace("*", "").strip()
+            if severity in ("Critical", "High", "Medium"):
+                current["severity"] = severity
+        elif current is not None and ("Page number" in trimmed or "Page:" in trimmed):
+            match = re.search(r"(\d+)", trimmed)
+            if match:
+                current["page"] = int(match.group(1))
+        elif current is not None and "Specific explanation" in trimmed:
+            colon = trimmed.find(":", trimmed.find("Specific explanation"))
+            if colon != -1:
+                current["summary"] = trimmed[colon + 1:].replace("*", "").strip()
+            j = i + 1
+            while j < len(lines) and lines[j].strip() and ":" not in lines[j]:
+                if current.get("summary"):
+                    current["summary"] += " " + lines[j].strip()
+                j += 1
+        elif current is not None and "AI reasoning" in trimmed:
+            colon = trimmed.find(":", trimmed.find("AI reasoning"))
+            if colon != -1:
+                current["ai_reasoning"] = trimmed[colon + 1:].replace("*", "").strip()
+
+    push(current)
+    return amendments
+
+
+def make_report():
+    return ComplianceReport(
+        amendments=[
+            Amendment(
+                category="Financial Statements",
+                issue="Missing reviewed financials",
+                rule="Rule 201(t)",
+                severity="Critical",
+                page=12,
+                summary="Statements for the most recent fiscal year\nare not reviewed.",
+                ai_reasoning="Offering exceeds the review threshold.",
+            ),
+            Amendment(
+                category="Use of Proceeds",
+                issue="Proceeds not itemised",
+                rule="Rule 201(i)",
+                severity="High",
+                page=0,
+                summary="Only a total is given.",
+                ai_reasoning="Itemisation is required.",
+            ),
+            Amendment(
+                category="Financial Statements",
+                issue="No going-concern note",
+                rule="Rule 201(t)",
+                severity="Medium",
+                page=14,
+                summary="Auditor doubt is not disclosed.",
+                ai_reasoning="Net losses in both years.",
+            ),
+        ],
+        verifications=[],
+        compliant_disclosures=[],
+        key_personnel=[],
+    )
+
+
+def test_one_category_header_per_category():
+    markdown = make_report().to_markdown()
+    assert CATEGORY_PATTERN.findall(markdown) == ["Financial Statements", "Use of Proceeds"]
+
+
+def test_amendments_round_trip_through_frontend_parser():
+    report = make_report()
+    parsed = parse_amendments(report.to_markdown())
+
+    # Grouping by category reorders amendments; page 0 renders as N/A, which the parser reads as 1
+    expected = [report.amendments[i] for i in (0, 2, 1)]
+    assert [(p["issue"], p["rule"], p["severity"], p["page"]) for p in parsed] == [
+        (a.issue, a.rule, a.severity, a.page or 1) for a in expected
+    ]
+    assert [p["summary"] for p in parsed] == [" ".join(a.summary.split()) for a in expected]
+    assert [p["ai_reasoning"] for p in parsed] == [a.ai_reasoning for a in expected]
@@ -3,79 +3,200 @@
 Extract text content from DOCX files to understand compliance requirements
 """
 
+import asyncio
+import io
 import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
 from docx import Document
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 
-def extract_docx_text(docx_path):
-    """Extract all text from a DOCX file"""
-    try:
-        doc = Document(docx_path)
-        full_text = []
-        
-        for para in doc.paragraphs:
-            if para.text.strip():
-                full_text.append(para.text)
-        
-        # Also extract from tables
-        for table in doc.tables:
-            for row in table.rows:
+from backend.app.file_cache import file_cache
+
+_PARAGRAPH_TAG = qn("w:p")
+_TABLE_TAG = qn("w:tbl")
+_BODY_TAG = qn("w:body")
+_ROW_TAG = qn("w:tr")
+_CELL_TAG = qn("w:tc")
+_TC_PR_TAG = qn("w:tcPr")
+_TR_PR_TAG = qn("w:trPr")
+_GRID_SPAN_TAG = qn("w:gridSpan")
+_GRID_BEFORE_TAG = qn("w:gridBefore")
+_V_MERGE_TAG = qn("w:vMerge")
+_RUN_TAG = qn("w:r")
+_HYPERLINK_TAG = qn("w:hyperlink")
+_BR_TAG = qn("w:br")
+_VAL_ATTR = qn("w:val")
+_TYPE_ATTR = qn("w:type")
+# Run content and its text, as in python-docx (w:br is handled separately)
+_TEXT_TAGS = {
+    qn("w:t"): None, qn("w:tab"): "\t", qn("w:ptab"): "\t",
+    _BR_TAG: None, qn("w:cr"): "\n", qn("w:noBreakHyphen"): "-",
+}
+
+def _xml_paragraph_text(p):
+    """Text of a w:p element, read from the same runs python-docx uses"""
+    parts = []
+    for child in p.iterchildren(_RUN_TAG, _HYPERLINK_TAG):
+        runs = child.iterchildren(_RUN_TAG) if child.tag == _HYPERLINK_TAG else (child,)
+        for run in runs:
+            for el in run.iterchildren(*_TEXT_TAGS):
+                if el.tag == _BR_TAG:
+                    # Line breaks become newlines; page and column breaks add nothing
+                    parts.append("\n" if el.get(_TYPE_ATTR, "textWrapping") == "textWrapping" else "")
+                    continue
+                replacement = _TEXT_TAGS[el.tag]
+                parts.append((el.text or "") if replacement is None else replacement)
+    return "".join(parts)
+
+def _xml_int(parent, tag, default):
+    """w:val of the child tag of parent (e.g. w:gridSpan in w:tcPr) as an int"""
+    el = parent.find(tag) if parent is not None else None
+    return int(el.get(_VAL_ATTR, default)) if el is not None else default
+
+def _xml_row_cells(row, above):
+    """
+    Text of each layout-grid cell of a w:tr, like python-docx's row.cells
+    
+    A cell spanning several grid columns is repeated for each, and a
+    vertically merged continuation cell takes the text of the cell above.
+    above is the previous row's result; returns {grid column: text}.
+    """
+    cells = {}
+    col = _xml_int(row.find(_TR_PR_TAG), _GRID_BEFORE_TAG, 0)
+    for tc in row.iterchildren(_CELL_TAG):
+        tc_pr = tc.find(_TC_PR_TAG)
+        span = _xml_int(tc_pr, _GRID_SPAN_TAG, 1)
+        v_merge = tc_pr.find(_V_MERGE_TAG) if tc_pr is not None else None
+        if v_merge is not None and v_merge.get(_VAL_ATTR, "continue") == "continue":
+            text = above.get(col, "")
+        else:
+            text = "\n".join(_xml_paragraph_text(p) for p in tc.iterchildren(_PARAGRAPH_TAG)).strip()
+        for c in range(col, col + span):
+            cells[c] = text
+        col += span
+    return cells
+
+def _iter_lines_xml(docx_path):
+    """
+    Same lines as _iter_lines, read straight from word/document.xml with
+    lxml.iterparse instead of building python-docx objects
+    
+    Merged table cells are repeated the way python-docx does, so both
+    paths produce the same text.
+    """
+    with zipfile.ZipFile(docx_path) as z, z.open("word/document.xml") as f:
+        for _, el in etree.iterparse(f, events=("end",), tag=(_PARAGRAPH_TAG, _TABLE_TAG)):
+            parent = el.getparent()
+            if parent is None or parent.tag != _BODY_TAG:
+                continue  # nested in a table - handled with its table
+            if el.tag == _PARAGRAPH_TAG:
+                text = _xml_paragraph_text(el)
+                if text and not text.isspace():
+                    yield text
+            else:
+                above = {}
+                for row in el.iterchildren(_ROW_TAG):
+                    above = _xml_row_cells(row, above)
+                    row_text = [cell for cell in above.values() if cell]
+                    if row_text:
+                        yield " | ".join(row_text)
+            # Free the finished element and anything parsed before it
+            el.clear()
+            while el.getprevious() is not None:
+                del parent[0]
+
+def _iter_lines(doc):
+    """
+    Yield the non-empty paragraphs and one " | "-joined line per table row,
+    in document order, walking the body XML once
+    """
+    for child in doc.element.body.iterchildren():
+        if child.tag == _PARAGRAPH_TAG:
+            text = Paragraph(child, doc).text
+            if text and not text.isspace():
+                yield text
+        elif child.tag == _TABLE_TAG:
+            for row in Table(child, doc).rows:
                 row_text = []
                 for cell in row.cells:
-                    cell_text = cell.text.strip()
-                    if cell_text:
-                        row_text.append(cell_text)
+                    # cell.text walks the cell's XML, so read it only once
+                    text = cell.text
+                    if text and not text.isspace():
+                        row_text.append(text.strip())
                 if row_text:
-                    full_text.append(" | ".join(row_text))
-        
-        return "\n".join(full_text)
+                    yield " | ".join(row_text)
+
+@file_cache(cache_if=lambda text: not text.startswith("Error extracting"), version=4)
+def extract_docx_text(docx_path):
+    """Extract all text from a DOCX file (cached by file contents; pass force_refresh=True to re-parse)"""
+    try:
+        buf = io.StringIO()
+        try:
+            buf.writelines(line + "\n" for line in _iter_lines_xml(docx_path))
+        except (KeyError, etree.XMLSyntaxError):
+            # Unusual package layout - fall back to python-docx
+            buf = io.StringIO()
+            buf.writelines(line + "\n" for line in _iter_lines(Document(docx_path)))
+        return buf.getvalue()[:-1]  # drop the final newline
     except Exception as e:
         return f"Error extracting {docx_path}: {str(e)}"
 
-def main():
+def max_parallel(n_jobs):
+    """Worker processes to use: EXTRACT_DOCS_MAX_PARALLEL (default CPUs - 1), clamped to the job count"""
+    cpus = os.cpu_count() or 1
+    requested = int(os.getenv("EXTRACT_DOCS_MAX_PARALLEL", max(1, cpus - 1)))
+    return max(1, min(requested, n_jobs, cpus))
+
+async def main():
     base_dir = "/Users/maximgavrish/hackathon"
     
-    # Extract compliance checklist
-    checklist_path = os.path.join(base_dir, "[Issuer] CF Offering Review Checklist[date].docx")
-    print("=" * 80)
-    print("COMPLIANCE CHECKLIST")
-    print("=" * 80)
-    if os.path.exists(checklist_path):
-        content = extract_docx_text(checklist_path)
-        output_path = os.path.join(base_dir, "extracted_checklist.txt")
-        with open(output_path, "w") as f:
-            f.write(content)
-        print(f"✓ Extracted to: {output_path}")
-        print(content[:500] + "...\n")
-    
-    # Extract review prompts
-    prompts_path = os.path.join(base_dir, "Form C Review Prompts.docx")
-    print("=" * 80)
-    print("REVIEW PROMPTS")
-    print("=" * 80)
-    if os.path.exists(prompts_path):
-        content = extract_docx_text(prompts_path)
-        output_path = os.path.join(base_dir, "extracted_prompts.txt")
-        with open(output_path, "w") as f:
-            f.write(content)
-        print(f"✓ Extracted to: {output_path}")
-        print(content[:500] + "...\n")
+    # (section title, source path, output file name)
+    jobs = [
+        ("COMPLIANCE CHECKLIST",
+         os.path.join(base_dir, "[Issuer] CF Offering Review Checklist[date].docx"),
+         "extracted_checklist.txt"),
+        ("REVIEW PROMPTS",
+         os.path.join(base_dir, "Form C Review Prompts.docx"),
+         "extracted_prompts.txt"),
+    ]
     
     # Extract one example from c-forms-issues
     issues_dir = os.path.join(base_dir, "c-forms-issues")
     if os.path.exists(issues_dir):
+        with os.scandir(issues_dir) as entries:
+            issue_files = [e.path for e in entries if e.name.endswith('.docx') and e.is_file()]
+        if issue_files:
+            jobs.append(("EXAMPLE ISSUE FORM (First file)",
+                         issue_files[0],
+                         "extracted_example_issue.txt"))
+    
+    # Parse the documents concurrently, in worker processes since parsing is
+    # CPU-bound, then write the outputs from here in job order
+    paths = [path for _, path, _ in jobs if os.path.exists(path)]
+    contents = {}
+    if paths:
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_parallel(len(paths))) as executor:
+            texts = await asyncio.gather(
+                *(loop.run_in_executor(executor, extract_docx_text, path) for path in paths)
+            )
+        contents = dict(zip(paths, texts))
+    
+    for title, path, output_name in jobs:
         print("=" * 80)
-        print("EXAMPLE ISSUE FORM (First file)")
+        print(title)
         print("=" * 80)
-        issue_files = [f for f in os.listdir(issues_dir) if f.endswith('.docx')]
-        if issue_files:
-            first_issue = os.path.join(issues_dir, issue_files[0])
-            content = extract_docx_text(first_issue)
-            output_path = os.path.join(base_dir, "extracted_example_issue.txt")
+        if path in contents:
+            content = contents[path]
+            output_path = os.path.join(base_dir, output_name)
             with open(output_path, "w") as f:
                 f.write(content)
-            print(f"✓ Extracted {issue_files[0]} to: {output_path}")
+            print(f"✓ Extracted {os.path.basename(path)} to: {output_path}")
             print(content[:500] + "...\n")
 
 if __name__ == "__main__":
-    main()
-
+    asyncio.run(main())